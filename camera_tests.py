@@ -0,0 +1,469 @@
+"""Smoke tests for V4L2 cameras: capture an image and a short video with
+ffmpeg, then sanity-check the results (validity, resolution, brightness,
+fps, audio presence).
+
+Usage:
+    python camera_tests.py              # test /dev/video0
+    python camera_tests.py /dev/video2  # test a specific device
+    python camera_tests.py all          # test every /dev/video* device
+"""
+
+import atexit
+import concurrent.futures
+import functools
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+
+try:
+    import av
+except ImportError:
+    av = None
+
+OUTPUT_DIR = "test_output"
+LOG_DIR = "logs"
+
+# Resolve the external tools once at import time instead of paying a
+# $PATH walk on every spawn; the fallbacks keep error messages sane on
+# hosts where a tool is missing entirely.
+FFMPEG = shutil.which("ffmpeg") or "/usr/bin/ffmpeg"
+FFPROBE = shutil.which("ffprobe") or "/usr/bin/ffprobe"
+V4L2CTL = shutil.which("v4l2-ctl") or "/usr/bin/v4l2-ctl"
+
+
+def _jpeg_dims(path):
+    """Return (width, height) from a JPEG's SOF header, or None.
+
+    Reads only the marker segments up to the first start-of-frame, so
+    checking validity/resolution costs a few dozen bytes of I/O instead
+    of a full libjpeg decode of the image.
+    """
+    try:
+        with open(path, "rb") as f:
+            if f.read(2) != b"\xff\xd8":
+                return None
+            while True:
+                byte = f.read(1)
+                if not byte:
+                    return None
+                if byte != b"\xff":
+                    continue
+                marker = f.read(1)
+                while marker == b"\xff":
+                    marker = f.read(1)
+                if not marker:
+                    return None
+                # Standalone markers (RSTn, TEM) carry no length field.
+                if marker[0] in range(0xD0, 0xD9) or marker[0] == 0x01:
+                    continue
+                segment = f.read(2)
+                if len(segment) < 2:
+                    return None
+                length = int.from_bytes(segment, "big")
+                if marker[0] in (0xC0, 0xC1, 0xC2, 0xC3):
+                    sof = f.read(5)
+                    if len(sof) < 5:
+                        return None
+                    height = int.from_bytes(sof[1:3], "big")
+                    width = int.from_bytes(sof[3:5], "big")
+                    return width, height
+                f.seek(length - 2, os.SEEK_CUR)
+    except OSError:
+        return None
+
+
+class CameraController:
+    """Thin wrapper around ffmpeg / v4l2-ctl for a single V4L2 device."""
+
+    # Hardware H.264 encoders in order of preference: NVENC (NVIDIA),
+    # QSV (Intel), V4L2 M2M (Pi and other SoCs), VAAPI (generic).
+    HARDWARE_ENCODERS = ("h264_nvenc", "h264_qsv", "h264_v4l2m2m", "h264_vaapi")
+
+    def __init__(self, device="/dev/video0", preset="veryfast"):
+        self.device = device
+        # libx264 preset for the software-encode fallback. veryfast is
+        # about as fast as ultrafast but produces ~40% smaller files,
+        # which cuts write bandwidth and downstream verification I/O.
+        self.preset = preset
+        self.encoder = self._detect_encoder()
+
+    def _detect_encoder(self):
+        """Pick a hardware H.264 encoder if this ffmpeg build ships one.
+
+        Probed once at construction; falls back to libx264 when no
+        fixed-function encoder is available (or ffmpeg is missing).
+        """
+        try:
+            result = subprocess.run(
+                [FFMPEG, "-hide_banner", "-encoders"],
+                capture_output=True,
+                text=True,
+            )
+        except OSError:
+            return "libx264"
+        for encoder in self.HARDWARE_ENCODERS:
+            if encoder in result.stdout:
+                return encoder
+        return "libx264"
+
+    def capture_image(self, output_path):
+        """Grab a single frame from the camera to output_path.
+
+        The input format is pinned and the real-time buffer capped at
+        1 MB so the grab comes from a live frame rather than draining
+        several stale ones queued by the default v4l2 ring.
+
+        When PyAV is installed the device is opened in-process instead
+        of forking ffmpeg: libavdevice maps the V4L2 buffers with mmap
+        and the MJPEG packet is written out as-is, skipping the extra
+        process and its user-space copies.
+        """
+        if av is not None:
+            try:
+                if self._capture_image_av(output_path):
+                    return True
+            except (OSError, av.FFmpegError):
+                pass
+        command = [
+            FFMPEG,
+            "-y",
+            "-f", "v4l2",
+            "-input_format", "mjpeg",
+            "-video_size", "1280x720",
+            "-framerate", "30",
+            "-rtbufsize", "1M",
+            "-i", self.device,
+            "-frames:v", "1",
+            output_path,
+        ]
+        result = subprocess.run(command, capture_output=True, text=True)
+        return result.returncode == 0
+
+    def _capture_image_av(self, output_path):
+        """Write one MJPEG packet from the device straight to disk.
+
+        Returns False without writing when the frame omits the Huffman
+        tables: many UVC cameras send MJPEG without a DHT segment, and
+        such a frame is not a standalone-decodable JPEG. The caller
+        then falls back to the ffmpeg subprocess, which reinserts the
+        tables.
+        """
+        options = {
+            "input_format": "mjpeg",
+            "video_size": "1280x720",
+            "framerate": "30",
+        }
+        with av.open(self.device, format="v4l2", options=options) as container:
+            for packet in container.demux(video=0):
+                if not packet.size:
+                    continue
+                data = bytes(packet)
+                if b"\xff\xc4" not in data:
+                    return False
+                with open(output_path, "wb") as f:
+                    f.write(data)
+                return True
+        return False
+
+    def record_video(self, output_path, duration=10, reencode=False):
+        """Record `duration` seconds of video to output_path.
+
+        By default the camera's MJPEG stream is muxed straight into the
+        container with `-c copy` -- no decode or encode at all, so the
+        cost is just bytes copied. Pass reencode=True to transcode to
+        H.264 instead, using the hardware encoder detected at
+        construction time (libx264 is the software fallback). Use an
+        .mkv output path for copy mode so the container accepts MJPEG.
+        """
+        command = [
+            FFMPEG,
+            "-y",
+            "-f", "v4l2",
+            "-input_format", "mjpeg",
+            "-video_size", "640x480",
+            "-framerate", "30",
+            "-rtbufsize", "1M",
+            "-t", str(duration),
+            "-i", self.device,
+        ]
+        if not reencode:
+            command += ["-c", "copy"]
+        elif self.encoder == "h264_nvenc":
+            command += [
+                "-c:v", "h264_nvenc",
+                "-preset", "p1",
+                "-tune", "ll",
+                "-rc", "cbr",
+                "-b:v", "4M",
+            ]
+        elif self.encoder in ("h264_qsv", "h264_v4l2m2m", "h264_vaapi"):
+            command += ["-c:v", self.encoder, "-b:v", "4M"]
+        else:
+            command += [
+                "-c:v", "libx264",
+                "-preset", self.preset,
+                "-pix_fmt", "yuv420p",
+                "-threads", "0",
+            ]
+        command.append(output_path)
+        process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        process.communicate()
+        return process.returncode == 0
+
+    def set_camera_properties(self, props):
+        """Set several V4L2 controls in one v4l2-ctl invocation.
+
+        v4l2-ctl accepts a comma-joined control list, so configuring N
+        controls costs one process spawn instead of N.
+        """
+        controls = ",".join(f"{prop}={value}" for prop, value in props.items())
+        subprocess.run(
+            [V4L2CTL, "-d", self.device, "--set-ctrl", controls],
+            capture_output=True,
+            text=True,
+        )
+
+    def get_camera_properties(self, props):
+        """Read back several V4L2 controls with one v4l2-ctl invocation."""
+        result = subprocess.run(
+            [V4L2CTL, "-d", self.device, "--get-ctrl", ",".join(props)],
+            capture_output=True,
+            text=True,
+        )
+        return result.stdout.strip()
+
+    def set_camera_property(self, prop, value):
+        """Set a single V4L2 control (e.g. brightness=128)."""
+        self.set_camera_properties({prop: value})
+
+    def get_camera_property(self, prop):
+        """Read back a single V4L2 control value."""
+        return self.get_camera_properties([prop])
+
+
+class CameraTests:
+    """Runs the capture + verification suite for one camera device."""
+
+    def __init__(self, camera_device="/dev/video0", session_ts=None):
+        self.controller = CameraController(camera_device)
+        self.output_dir = OUTPUT_DIR
+        self.log_dir = LOG_DIR
+        if session_ts is None:
+            # Standalone use: set up the session here. When iterating
+            # several cameras, __main__ does this once and passes the
+            # shared timestamp in, so N cameras cost one makedirs round
+            # and their logs correlate on a single session stamp.
+            self.timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            os.makedirs(self.output_dir, exist_ok=True)
+            os.makedirs(self.log_dir, exist_ok=True)
+        else:
+            self.timestamp = session_ts
+        device_tag = os.path.basename(camera_device)
+        self.image_path = os.path.join(
+            self.output_dir, f"image_{device_tag}_{self.timestamp}.jpg"
+        )
+        self.video_path = os.path.join(
+            self.output_dir, f"video_{device_tag}_{self.timestamp}.mkv"
+        )
+        self.log_path = os.path.join(
+            self.log_dir, f"camera_test_{device_tag}_{self.timestamp}.log"
+        )
+        self.expected_width = 1280
+        self.expected_height = 720
+        # One line-buffered handle for the whole run; opening and
+        # closing the file per message cost ~4 syscalls per log line.
+        # TextIOWrapper is not thread-safe, and the video checks log
+        # from worker threads, so writes go through a lock.
+        self._log_lock = threading.Lock()
+        self._log_f = open(self.log_path, "w", buffering=1)
+        self._log_f.write(f"Camera test log - {self.timestamp}\n")
+        self._log_f.write(f"Device: {camera_device}\n\n")
+        atexit.register(self._log_f.close)
+
+    def log(self, message):
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._log_lock:
+            self._log_f.write(f"{timestamp} - {message}\n")
+
+    def close(self):
+        """Release the log handle; safe to call more than once."""
+        self._log_f.close()
+
+    @staticmethod
+    def _wait_for_file(path):
+        """Poll for a non-empty file with exponential backoff (~1.3 s cap).
+
+        ffmpeg usually finishes the write within tens of milliseconds,
+        so starting at 10 ms avoids the flat one-second sleep the old
+        retry loop paid even on the fast path.
+        """
+        for delay in (0.01, 0.02, 0.04, 0.08, 0.16, 0.32, 0.64):
+            if os.path.exists(path) and os.path.getsize(path) > 0:
+                return True
+            time.sleep(delay)
+        return os.path.exists(path) and os.path.getsize(path) > 0
+
+    def capture_image(self):
+        self.log("Capturing test image...")
+        for attempt in range(3):
+            if self.controller.capture_image(self.image_path):
+                if self._wait_for_file(self.image_path):
+                    self.log("Image captured")
+                    return True
+            self.log(f"Capture attempt {attempt + 1} failed, retrying...")
+        self.log("Image capture failed")
+        return False
+
+    def test_image_validity(self):
+        ok = _jpeg_dims(self.image_path) is not None
+        self.log(f"Image validity: {'PASS' if ok else 'FAIL'}")
+        return ok
+
+    def test_image_resolution(self):
+        dims = _jpeg_dims(self.image_path)
+        if dims is None:
+            self.log("Image resolution: FAIL (unreadable)")
+            return False
+        width, height = dims
+        ok = width == self.expected_width and height == self.expected_height
+        self.log(f"Image resolution: {'PASS' if ok else 'FAIL'} ({width}x{height})")
+        return ok
+
+    def test_image_brightness(self):
+        # draft() makes libjpeg decode grayscale at 1/8 scale by dropping
+        # high-frequency DCT coefficients; the mean is unchanged by the
+        # uniform downsampling, so the 50-200 window still applies.
+        try:
+            with Image.open(self.image_path) as im:
+                im.draft("L", (160, 90))
+                im.load()
+                avg = np.asarray(im.convert("L"), dtype=np.uint8).mean()
+        except OSError:
+            self.log("Image brightness: FAIL (unreadable)")
+            return False
+        ok = 50 <= avg <= 200
+        self.log(f"Image brightness: {'PASS' if ok else 'FAIL'} (avg {avg:.1f})")
+        return ok
+
+    def record_video(self):
+        self.log("Recording test video...")
+        ok = self.controller.record_video(self.video_path, duration=5)
+        self.log("Video recorded" if ok else "Video recording failed")
+        return ok
+
+    @functools.cached_property
+    def _probe(self):
+        """Stream metadata for the recorded video, probed exactly once.
+
+        The three video tests all read from this dict, so a full run
+        costs one ffprobe spawn and one JSON parse instead of three.
+        """
+        result = subprocess.run(
+            [
+                FFPROBE,
+                "-v", "error",
+                "-show_streams",
+                "-of", "json",
+                self.video_path,
+            ],
+            capture_output=True,
+            text=True,
+        )
+        try:
+            return json.loads(result.stdout or "{}")
+        except json.JSONDecodeError:
+            return {}
+
+    def _video_streams(self, codec_type):
+        return [
+            s
+            for s in self._probe.get("streams", [])
+            if s.get("codec_type") == codec_type
+        ]
+
+    def test_video_validity(self):
+        ok = any("width" in s for s in self._video_streams("video"))
+        self.log(f"Video validity: {'PASS' if ok else 'FAIL'}")
+        return ok
+
+    def test_video_fps(self):
+        streams = self._video_streams("video")
+        fps_str = streams[0].get("r_frame_rate", "") if streams else ""
+        if not fps_str:
+            self.log("Video fps: FAIL (no video stream)")
+            return False
+        try:
+            num, den = map(int, fps_str.split("/"))
+            fps = num / den
+        except (ValueError, ZeroDivisionError):
+            self.log(f"Video fps: FAIL (unparseable rate {fps_str!r})")
+            return False
+        ok = 25 <= fps <= 35
+        self.log(f"Video fps: {'PASS' if ok else 'FAIL'} ({fps:.1f})")
+        return ok
+
+    def test_video_audio(self):
+        ok = any(s.get("codec_name") for s in self._video_streams("audio"))
+        self.log(f"Video audio: {'PASS' if ok else 'FAIL'}")
+        return ok
+
+    def run_tests(self):
+        self.log(f"Using encoder: {self.controller.encoder}")
+        results = {}
+        if self.capture_image():
+            results["image_validity"] = self.test_image_validity()
+            results["image_resolution"] = self.test_image_resolution()
+            results["image_brightness"] = self.test_image_brightness()
+        else:
+            results["image_capture"] = False
+        if self.record_video():
+            # Touch _probe once so the cached ffprobe run happens before
+            # the threads start, then let the three checks overlap.
+            self._probe
+            with concurrent.futures.ThreadPoolExecutor(max_workers=3) as ex:
+                futures = {
+                    "video_validity": ex.submit(self.test_video_validity),
+                    "video_fps": ex.submit(self.test_video_fps),
+                    "video_audio": ex.submit(self.test_video_audio),
+                }
+                for name, future in futures.items():
+                    results[name] = future.result()
+        else:
+            results["video_record"] = False
+        passed = sum(1 for ok in results.values() if ok)
+        self.log(f"{passed}/{len(results)} tests passed")
+        self.close()
+        return results
+
+
+if __name__ == "__main__":
+    device = sys.argv[1] if len(sys.argv) > 1 else "/dev/video0"
+    if device == "all":
+        cameras = sorted(glob.glob("/dev/video*"))
+        if not cameras:
+            print("No /dev/video* devices found")
+            sys.exit(1)
+        session_ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        os.makedirs(LOG_DIR, exist_ok=True)
+        for cam in cameras:
+            tests = CameraTests(camera_device=cam, session_ts=session_ts)
+            results = tests.run_tests()
+            print(f"{cam}: {results}")
+    else:
+        tests = CameraTests(camera_device=device)
+        print(tests.run_tests())